@@ -1,2 +1,5 @@
+from .buffer import *  # NOQA
 from .client import *  # NOQA
 from .exceptions import *  # NOQA
+from .planner import *  # NOQA
+from .profiling import *  # NOQA
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import calendar
+from datetime import datetime
+
+from pydatamailbox.exceptions import DataMailboxArgsError
+
+__all__ = ("MergeBuffer",)
+
+DATE_FORMATS = ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f")
+
+
+def parse_date(value):
+    """
+    Converts a Talk2M ISO date (ie. `2018-10-11T01:07:08Z`) into a UTC timestamp, keeping the microseconds.
+    """
+    value = value.rstrip("Z")
+    for date_format in DATE_FORMATS:
+        try:
+            date = datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        return calendar.timegm(date.utctimetuple()) + date.microsecond / 1e6
+    raise DataMailboxArgsError("Cannot parse date %s" % value)
+
+
+DUPLICATE = "duplicate"
+LATE = "late"
+
+
+class TagBuffer(object):
+    """
+    Pending history of a single tag, kept as two parallel arrays sorted by date.
+    """
+
+    def __init__(self):
+        self.dates = []
+        self.points = []
+        self.last_date = None
+        self.emitted_date = None
+
+    def add(self, date, point):
+        """
+        Inserts `point`, returns `DUPLICATE` or `LATE` if it is dropped.
+        """
+        if self.emitted_date is not None:
+            if date == self.emitted_date:
+                return DUPLICATE
+            if date < self.emitted_date:
+                return LATE
+        index = bisect.bisect_left(self.dates, date)
+        if index < len(self.dates) and self.dates[index] == date:
+            return DUPLICATE
+        self.dates.insert(index, date)
+        self.points.insert(index, point)
+        if self.last_date is None or date > self.last_date:
+            self.last_date = date
+        return None
+
+    def pop(self, watermark=None):
+        if watermark is None:
+            index = len(self.dates)
+        else:
+            index = bisect.bisect_right(self.dates, watermark)
+        if not index:
+            return []
+        points = self.points[:index]
+        self.emitted_date = self.dates[index - 1]
+        del self.dates[:index]
+        del self.points[:index]
+        return points
+
+
+class MergeBuffer(object):
+    """
+    Merges overlapping history chunks returned by ``getdata`` and ``syncdata``.
+
+    Points are buffered per `(ewon id, tag id)` and indexed by date. A point whose date is already
+    buffered or is the last emitted one for the same tag is dropped and counted in `duplicates`, so
+    re-syncing after a failure or mixing a ``getdata`` backfill with ``syncdata`` streaming never
+    yields the same point twice.
+
+    Each tag has a watermark equal to its most recent date minus `window`. Points older than the
+    watermark cannot be reordered anymore: they are returned by :meth:`pop` in strictly increasing
+    date order. Points arriving behind the last emitted date are dropped and counted in `late`.
+    Memory is thus bounded by the number of points within the out-of-order window.
+
+    A ``getdata`` backfill must therefore be pushed before the ``syncdata`` stream of the same tags
+    is popped past its range, otherwise the backfilled points are late and lost.
+
+    :param int window: The out-of-order tolerance in seconds.
+    """
+
+    def __init__(self, window=0):
+        if window < 0:
+            raise DataMailboxArgsError("window cannot be negative")
+        self.window = window
+        self.tags = {}
+        self.duplicates = 0
+        self.late = 0
+
+    def __len__(self):
+        return sum(len(tag.dates) for tag in self.tags.values())
+
+    def add(self, ewon_id, tag_id, history):
+        """
+        Adds the history of a single tag.
+
+        All the dates are parsed before inserting any point: on error, the buffer is left untouched.
+
+        :param int ewon_id: ID of the Ewon gateway.
+        :param int tag_id: ID of the tag.
+        :param list history: Points as returned by the api, ie. `{"date": "2018-10-11T01:07:08Z", "value": 0.0}`.
+        """
+        self._insert([(ewon_id, tag_id, self._parse(history))])
+
+    def push(self, response):
+        """
+        Adds all the history contained in a ``getdata`` or ``syncdata`` response.
+
+        All the dates are parsed before inserting any point: on error, the buffer is left untouched.
+
+        :param dict response: The api response.
+        """
+        self._insert(
+            [
+                (ewon["id"], tag["id"], self._parse(tag.get("history", [])))
+                for ewon in response.get("ewons", [])
+                for tag in ewon.get("tags", [])
+            ]
+        )
+
+    def _parse(self, history):
+        return [(parse_date(point["date"]), point) for point in history]
+
+    def _insert(self, chunks):
+        for ewon_id, tag_id, history in chunks:
+            key = (ewon_id, tag_id)
+            tag = self.tags.get(key)
+            if tag is None:
+                tag = self.tags[key] = TagBuffer()
+            for date, point in history:
+                status = tag.add(date, point)
+                if status == DUPLICATE:
+                    self.duplicates += 1
+                elif status == LATE:
+                    self.late += 1
+
+    def pop(self):
+        """
+        Returns the batches which passed the watermark, as a list of `(ewon id, tag id, history)`.
+        """
+        batches = []
+        for (ewon_id, tag_id), tag in self.tags.items():
+            if tag.last_date is None:
+                continue
+            points = tag.pop(tag.last_date - self.window)
+            if points:
+                batches.append((ewon_id, tag_id, points))
+        return batches
+
+    def flush(self):
+        """
+        Returns all the pending batches regardless of the watermark, as a list of `(ewon id, tag id, history)`.
+        """
+        batches = []
+        for (ewon_id, tag_id), tag in self.tags.items():
+            points = tag.pop()
+            if points:
+                batches.append((ewon_id, tag_id, points))
+        return batches
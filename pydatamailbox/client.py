@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import json
+import time
+
 import requests
 
 from pydatamailbox.exceptions import (
@@ -9,14 +11,16 @@ from pydatamailbox.exceptions import (
     DataMailboxResponseError,
     DataMailboxStatusError,
 )
+from pydatamailbox.profiling import profiled
 
 __all__ = ("DataMailbox", "M2Web")
 
 
 class EwonClient(object):
-    def __init__(self, base_url, account, data=None, timeout=None):
+    def __init__(self, base_url, account, data=None, timeout=None, profiler=None):
         self.account = account
         self.timeout = timeout
+        self.profiler = profiler
         self.data = data
         self.base_url = base_url
         self.session = requests.Session()
@@ -31,10 +35,21 @@ class EwonClient(object):
         return self.base_url + url
 
     def _request(self, url, data, check_success=True):
+        profiler = self.profiler
+        if profiler:
+            profiler.mark("build")
         try:
-            response = self.session.post(url=url, data=data, timeout=self.timeout)
+            response = self.session.post(
+                url=url, data=data, timeout=self.timeout, stream=bool(profiler)
+            )
         except requests.exceptions.ConnectionError as e:  # pragma: nocover
             raise DataMailboxConnectionError(str(e))  # pragma: nocover
+        if profiler:
+            now = time.perf_counter()
+            profiler.mark("send", now - response.elapsed.total_seconds())
+            profiler.mark("wait", now)
+            response.content  # Reads the streamed body
+            profiler.mark("download")
         if response.status_code != 200:
             raise DataMailboxStatusError(
                 "Bad status from talk2m: %s" % response.status_code
@@ -45,11 +60,15 @@ class EwonClient(object):
             raise DataMailboxResponseError(
                 "Cannot deserialize json from %s" % response.content
             )
+        if profiler:
+            profiler.mark("decode")
         if check_success and not content["success"]:
             raise DataMailboxStatusError(
                 "Got error code=%(code)s, message=%(message)s" % content
             )
-        return response.json()
+        if profiler:
+            profiler.mark("check")
+        return content
 
 
 class DataMailbox(EwonClient):
@@ -60,7 +79,7 @@ class DataMailbox(EwonClient):
     The authentication is done by providing either `username` and `password` or `token`.
     """
 
-    def __init__(self, account, devid, timeout=None, **kwargs):
+    def __init__(self, account, devid, timeout=None, profiler=None, **kwargs):
         data = {"t2mdevid": devid}
         if "token" in kwargs:
             data["t2mtoken"] = kwargs["token"]
@@ -68,8 +87,9 @@ class DataMailbox(EwonClient):
             data["t2maccount"] = account
             data["t2musername"] = kwargs["username"]
             data["t2mpassword"] = kwargs["password"]
-        super().__init__("https://data.talk2m.com/", account, data, timeout)
+        super().__init__("https://data.talk2m.com/", account, data, timeout, profiler)
 
+    @profiled
     def getstatus(self):
         """
         Returns the storage consumption of the account and of each Ewon.
@@ -91,6 +111,7 @@ class DataMailbox(EwonClient):
             url=self._build_url("getstatus"), data=self.data, check_success=False
         )
 
+    @profiled
     def getewons(self):
         """
         Returns the list of Ewons sending data to be stored in the DataMailbox. The result contains the following information for each Ewon:
@@ -101,6 +122,7 @@ class DataMailbox(EwonClient):
         """
         return self._request(url=self._build_url("getewons"), data=self.data)
 
+    @profiled
     def getewon(self, ewonid=None, name=None):
         """
         Returns the configuration of the targeted Ewon as seen by the DataMailbox.
@@ -117,6 +139,7 @@ class DataMailbox(EwonClient):
             data["name"] = name
         return self._request(url=self._build_url("getewon"), data=data)
 
+    @profiled
     def syncdata(
         self, last_transaction_id=None, create_transaction=True, ewon_ids=None
     ):
@@ -141,6 +164,7 @@ class DataMailbox(EwonClient):
             data["ewonIds"] = ",".join([str(ewon_id) for ewon_id in ewon_ids])
         return self._request(url=self._build_url("syncdata"), data=data)
 
+    @profiled
     def getdata(self, ewon_id, tag_id, from_ts, to_ts, limit=None):
         """
         ``getdata`` is used as a “one-shot” request to retrieve filtered data based on specific
@@ -177,7 +201,13 @@ class DataMailbox(EwonClient):
         """
         while True:
             ret = self.syncdata(last_transaction_id, ewon_ids=ewon_ids)
-            yield ret
+            call = self.profiler.last_call() if self.profiler else None
+            start = time.perf_counter()
+            try:
+                yield ret
+            finally:
+                if call is not None:
+                    self.profiler.consumer(call, start)
             if not ret.get("moreDataAvailable"):
                 break
             last_transaction_id = ret["transactionId"]
@@ -190,15 +220,18 @@ class M2Web(EwonClient):
     This client only supports: getaccountinfo, getewons, getewon
     """
 
-    def __init__(self, account, username, password, devid, timeout=None):
+    def __init__(self, account, username, password, devid, timeout=None, profiler=None):
         data = {
             "t2maccount": account,
             "t2musername": username,
             "t2mpassword": password,
             "t2mdeveloperid": devid,
         }
-        super().__init__("https://m2web.talk2m.com/t2mapi/", account, data, timeout)
+        super().__init__(
+            "https://m2web.talk2m.com/t2mapi/", account, data, timeout, profiler
+        )
 
+    @profiled
     def getaccountinfo(self):
         """
         Retrieves the basic account information (reference, name, company).
@@ -211,6 +244,7 @@ class M2Web(EwonClient):
             url=self._build_url("getaccountinfo"), data=self.data, check_success=True
         )
 
+    @profiled
     def getewons(self, pool=None):
         """
         Returns the set of Ewons visible by user along with their properties: displayable names, link names, status, description, the 3 custom attributes, preferred m2web server hostname (currently always m2web.talk2m.com).
@@ -222,6 +256,7 @@ class M2Web(EwonClient):
             data["pool"] = pool
         return self._request(url=self._build_url("getewons"), data=self.data)
 
+    @profiled
     def getewon(self, ewonid=None, name=None):
         """
         Returns the configuration of the targeted Ewon as seen by the DataMailbox.
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import math
+import time
+
+from pydatamailbox.buffer import parse_date
+from pydatamailbox.exceptions import DataMailboxArgsError, DataMailboxResponseError
+
+__all__ = ("SnapshotPlan", "SnapshotPlanner")
+
+
+def format_date(timestamp):
+    """
+    Converts a UTC timestamp into a Talk2M ISO date (ie. `2018-10-11T01:07:08Z`).
+    """
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+
+
+class SnapshotPlan(object):
+    """
+    A set of independent ``getdata``/``syncdata`` work units covering the history of an account.
+
+    Units are plain json serializable dicts identified by a stable `id`, so a plan can be stored
+    with :meth:`to_dict`, shared between workers and resumed with :meth:`pending`.
+
+    :param list units: The work units.
+    :param int target_points: The number of history points requested per call.
+    :param float request_time: The estimated duration of a call in seconds.
+    """
+
+    def __init__(self, units, target_points, request_time):
+        self.units = units
+        self.target_points = target_points
+        self.request_time = request_time
+
+    def __len__(self):
+        return len(self.units)
+
+    @property
+    def points(self):
+        """
+        Estimated number of history points covered by the plan.
+        """
+        return sum(unit["points"] for unit in self.units)
+
+    @property
+    def requests(self):
+        """
+        Estimated number of api calls needed to run the plan.
+
+        The ``syncdata`` page size is decided by the server, so this is a lower bound unless the
+        planner was given the actual `page_size`.
+        """
+        return sum(unit["requests"] for unit in self.units)
+
+    def estimate_time(self, workers=1):
+        """
+        Estimates the time in seconds needed to run the plan with `workers` parallel executors.
+
+        :param int workers: The number of units run in parallel.
+        """
+        if workers < 1:
+            raise DataMailboxArgsError("workers must be greater than 0")
+        loads = [0.0] * workers
+        for unit in sorted(self.units, key=lambda unit: -unit["requests"]):
+            heapq.heappush(
+                loads, heapq.heappop(loads) + unit["requests"] * self.request_time
+            )
+        return max(loads)
+
+    def pending(self, done=()):
+        """
+        Returns the units which are not done yet.
+
+        :param done: The ids of the units already run.
+        """
+        done = set(done)
+        return [unit for unit in self.units if unit["id"] not in done]
+
+    def execute(self, client, unit):
+        """
+        Runs a single unit and yields the api responses.
+
+        Units do not share any state, so they can be run in any order and in parallel.
+        ``getdata`` units follow `moreDataAvailable` by restarting from the last returned date:
+        the boundary point is returned twice, use a :class:`MergeBuffer` to drop it.
+        A :class:`DataMailboxResponseError` is raised if a page does not go past its `from` date,
+        ie. when more points than `target_points` share the same date.
+
+        :param DataMailbox client: The client used to run the unit.
+        :param dict unit: A unit of this plan.
+        """
+        if unit["api"] == "syncdata":
+            yield from client.iterate_syncdata(ewon_ids=unit["ewon_ids"])
+            return
+        from_ts = unit["from"]
+        from_date = parse_date(from_ts)
+        while True:
+            ret = client.getdata(
+                unit["ewon_id"],
+                unit["tag_id"],
+                from_ts,
+                unit["to"],
+                limit=self.target_points,
+            )
+            yield ret
+            if not ret.get("moreDataAvailable"):
+                break
+            dates = [
+                (parse_date(point["date"]), point["date"])
+                for ewon in ret.get("ewons", [])
+                for tag in ewon.get("tags", [])
+                for point in tag.get("history", [])
+            ]
+            if not dates or max(dates)[0] <= from_date:
+                raise DataMailboxResponseError(
+                    "getdata did not return data after %s for unit %s"
+                    % (from_ts, unit["id"])
+                )
+            from_date, from_ts = max(dates)
+
+    def to_dict(self):
+        """
+        Returns the plan as a json serializable dict, to be restored with :meth:`from_dict`.
+        """
+        return {
+            "units": self.units,
+            "target_points": self.target_points,
+            "request_time": self.request_time,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Returns the plan stored by :meth:`to_dict`.
+
+        :param dict data: The stored plan.
+        """
+        return cls(data["units"], data["target_points"], data["request_time"])
+
+
+class SnapshotPlanner(object):
+    """
+    Builds a :class:`SnapshotPlan` from the figures returned by ``getstatus`` and ``getewon``.
+
+    Ewons storing at most `target_points` points are packed together into ``syncdata`` units.
+    Larger Ewons are split per tag, assuming the history is evenly spread between tags and over
+    time, then per period into ``getdata`` units of about `target_points` points, unless a single
+    ``syncdata`` unit needs fewer calls (ie. many tags with a few points each). ``getewon`` is only
+    called for those larger Ewons. Ewons without first or last history date get a ``syncdata`` unit.
+
+    Periods are bounded to whole seconds, so there are at most as many periods as seconds between
+    the first and the last history dates (a single one when they are equal). ``getdata`` returns
+    the points at its `from` and `to` dates, and two consecutive periods share a bound: a point
+    dated exactly on a bound is returned by both units, never lost. Use a :class:`MergeBuffer` to
+    drop it.
+
+    :param DataMailbox client: The client used to retrieve the figures.
+    :param int target_points: The number of history points requested per call.
+    :param float request_time: The estimated duration of a call in seconds.
+    :param int page_size: The number of history points returned by the server per ``syncdata`` call. If not provided, `target_points` is used and the estimated number of ``syncdata`` calls is a lower bound.
+    """
+
+    def __init__(self, client, target_points=10000, request_time=1.0, page_size=None):
+        if target_points < 1:
+            raise DataMailboxArgsError("target_points must be greater than 0")
+        if page_size is not None and page_size < 1:
+            raise DataMailboxArgsError("page_size must be greater than 0")
+        self.client = client
+        self.target_points = target_points
+        self.request_time = request_time
+        self.page_size = page_size or target_points
+
+    def plan(self, ewon_ids=None):
+        """
+        Returns the plan covering the whole history currently stored in the DataMailbox.
+
+        :param list ewon_ids: A list of Ewon gateway IDs. If not used, all the Ewon gateways are planned.
+        """
+        ewons = [
+            ewon
+            for ewon in self.client.getstatus().get("ewons", [])
+            if ewon.get("historyCount") and (not ewon_ids or ewon["id"] in ewon_ids)
+        ]
+        units = []
+        small = []
+        for ewon in ewons:
+            if ewon["historyCount"] <= self.target_points:
+                small.append(ewon)
+                continue
+            syncdata_unit = self._syncdata_unit([ewon])
+            if not ewon.get("firstHistoryDate") or not ewon.get("lastHistoryDate"):
+                units.append(syncdata_unit)
+                continue
+            tags = self.client.getewon(ewonid=ewon["id"]).get("tags", [])
+            getdata_units = list(self._getdata_units(ewon, tags)) if tags else []
+            if (
+                getdata_units
+                and sum(unit["requests"] for unit in getdata_units)
+                <= syncdata_unit["requests"]
+            ):
+                units.extend(getdata_units)
+            else:
+                units.append(syncdata_unit)
+        units.extend(self._syncdata_units(small))
+        return SnapshotPlan(units, self.target_points, self.request_time)
+
+    def _getdata_units(self, ewon, tags):
+        points = ewon["historyCount"] / len(tags)
+        start = math.floor(parse_date(ewon["firstHistoryDate"]))
+        end = math.ceil(parse_date(ewon["lastHistoryDate"]))
+        span = max(end - start, 0)
+        # At most one period per second: bounds are then strictly increasing.
+        slices = max(min(math.ceil(points / self.target_points), span), 1)
+        bounds = [start + index * span // slices for index in range(slices + 1)]
+        slice_points = math.ceil(points / slices)
+        for tag in tags:
+            for index in range(slices):
+                yield {
+                    "id": "getdata:%s:%s:%s" % (ewon["id"], tag["id"], index),
+                    "api": "getdata",
+                    "ewon_id": ewon["id"],
+                    "tag_id": tag["id"],
+                    "from": format_date(bounds[index]),
+                    "to": format_date(bounds[index + 1]),
+                    "points": slice_points,
+                    "requests": math.ceil(slice_points / self.target_points),
+                }
+
+    def _syncdata_units(self, ewons):
+        # First fit decreasing: pack the Ewons into as few units as possible.
+        groups = []
+        for ewon in sorted(ewons, key=lambda ewon: -ewon["historyCount"]):
+            for group in groups:
+                if (
+                    sum(item["historyCount"] for item in group) + ewon["historyCount"]
+                    <= self.target_points
+                ):
+                    group.append(ewon)
+                    break
+            else:
+                groups.append([ewon])
+        return [self._syncdata_unit(group) for group in groups]
+
+    def _syncdata_unit(self, ewons):
+        ewon_ids = sorted(ewon["id"] for ewon in ewons)
+        points = sum(ewon["historyCount"] for ewon in ewons)
+        return {
+            "id": "syncdata:%s" % ",".join(str(ewon_id) for ewon_id in ewon_ids),
+            "api": "syncdata",
+            "ewon_ids": ewon_ids,
+            "points": points,
+            "requests": max(math.ceil(points / self.page_size), 1),
+        }
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+__all__ = ("Profiler",)
+
+
+def percentile(values, q):
+    """
+    Returns the `q` percentile of sorted `values` using the nearest rank method.
+    """
+    if not values:
+        return 0.0
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+def profiled(func):
+    """
+    Records an api call on the client profiler, if any.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self.profiler is None:
+            return func(self, *args, **kwargs)
+        self.profiler.begin(func.__name__)
+        try:
+            ret = func(self, *args, **kwargs)
+        except BaseException as e:
+            self.profiler.end(error=e)
+            raise
+        self.profiler.end()
+        return ret
+
+    return wrapper
+
+
+class Profiler(object):
+    """
+    Records a per stage timing breakdown of every api call made by a client.
+
+    The stages of a call are:
+
+    - `build`: building the url and the form data,
+    - `send`: preparing the request and merging the session settings,
+    - `wait`: getting a connection (including tcp and tls setup), sending the request and waiting for the response headers,
+    - `download`: reading the response body,
+    - `decode`: deserializing the json,
+    - `check`: checking the status and the success of the response,
+    - `consumer`: time spent by the caller between two pages of ``iterate_syncdata``.
+
+    `wait` is the `elapsed` time measured by `requests`, which does not tell when the connection is
+    established nor when the request is fully sent: both are part of `wait`.
+
+    `consumer` happens after the call returned: it is not part of the call duration nor of its
+    breakdown, and is exported as its own trace event following the call.
+
+    Usage::
+
+        profiler = Profiler()
+        client = DataMailbox(..., profiler=profiler)
+        for data in client.iterate_syncdata():
+            pass
+        profiler.report()
+        with open("trace.json", "w") as fp:
+            profiler.dump_trace(fp)
+    """
+
+    STAGES = ("build", "send", "wait", "download", "decode", "check", "consumer")
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.calls = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def begin(self, name):
+        """
+        Starts recording a call.
+        """
+        now = time.perf_counter()
+        self.local.call = {
+            "name": name,
+            "thread": threading.get_ident(),
+            "start": now,
+            "duration": None,
+            "stages": [],
+            "consumer": None,
+            "error": None,
+        }
+        self.local.mark = now
+
+    def mark(self, stage, end=None):
+        """
+        Records `stage` of the current call, from the previous mark to `end` (defaults to now).
+        """
+        call = getattr(self.local, "call", None)
+        if call is None or call["duration"] is not None:
+            return
+        end = time.perf_counter() if end is None else end
+        call["stages"].append((stage, self.local.mark, end))
+        self.local.mark = end
+
+    def end(self, error=None):
+        """
+        Stops recording the current call.
+        """
+        call = getattr(self.local, "call", None)
+        if call is None or call["duration"] is not None:
+            return
+        call["duration"] = time.perf_counter() - call["start"]
+        if error is not None:
+            call["error"] = type(error).__name__
+        with self.lock:
+            self.calls.append(call)
+
+    def last_call(self):
+        """
+        Returns the record of the last call of the thread, if any.
+        """
+        return getattr(self.local, "call", None)
+
+    def consumer(self, call, start):
+        """
+        Records the time spent by the caller since `start` after the `call` returned.
+        """
+        with self.lock:
+            call["consumer"] = (start, time.perf_counter())
+
+    def reset(self):
+        with self.lock:
+            self.calls = []
+
+    def report(self, slowest=5):
+        """
+        Aggregates the recorded calls.
+
+        Returns the number of calls, statistics (count, total, mean, p50, p90, p99, max) of the call
+        durations and of each stage, and the `slowest` calls with their breakdown and consumer time.
+        Times are in seconds.
+
+        :param int slowest: The number of slowest calls to return.
+        """
+        with self.lock:
+            calls = list(self.calls)
+        stages = {}
+        for call in calls:
+            for stage, start, end in call["stages"]:
+                stages.setdefault(stage, []).append(end - start)
+            if call["consumer"]:
+                start, end = call["consumer"]
+                stages.setdefault("consumer", []).append(end - start)
+        return {
+            "calls": len(calls),
+            "duration": self._stats([call["duration"] for call in calls]),
+            "stages": {
+                stage: self._stats(stages[stage])
+                for stage in self.STAGES
+                if stage in stages
+            },
+            "slowest": [
+                {
+                    "name": call["name"],
+                    "duration": call["duration"],
+                    "error": call["error"],
+                    "stages": self._breakdown(call),
+                    "consumer": (
+                        call["consumer"][1] - call["consumer"][0]
+                        if call["consumer"]
+                        else None
+                    ),
+                }
+                for call in sorted(calls, key=lambda call: -call["duration"])[:slowest]
+            ],
+        }
+
+    def trace_events(self):
+        """
+        Returns the recorded calls in the trace event format, viewable in chrome://tracing,
+        `Perfetto <https://ui.perfetto.dev>`_ or `speedscope <https://www.speedscope.app>`_.
+        """
+        pid = os.getpid()
+        with self.lock:
+            calls = list(self.calls)
+        events = []
+        for call in calls:
+            events.append(
+                self._event(
+                    call["name"],
+                    "call",
+                    call["start"],
+                    call["start"] + call["duration"],
+                    pid,
+                    call["thread"],
+                    {"error": call["error"]} if call["error"] else {},
+                )
+            )
+            for stage, start, end in call["stages"]:
+                events.append(
+                    self._event(stage, "stage", start, end, pid, call["thread"], {})
+                )
+            if call["consumer"]:
+                start, end = call["consumer"]
+                events.append(
+                    self._event(
+                        "consumer",
+                        "consumer",
+                        start,
+                        end,
+                        pid,
+                        call["thread"],
+                        {"call": call["name"]},
+                    )
+                )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump_trace(self, fp):
+        """
+        Writes the trace events as json into `fp`.
+        """
+        json.dump(self.trace_events(), fp)
+
+    def _event(self, name, category, start, end, pid, tid, args):
+        return {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": pid,
+            "tid": tid,
+            "args": args,
+        }
+
+    def _breakdown(self, call):
+        breakdown = {}
+        for stage, start, end in call["stages"]:
+            breakdown[stage] = breakdown.get(stage, 0.0) + end - start
+        return breakdown
+
+    def _stats(self, values):
+        values = sorted(values)
+        total = sum(values)
+        return {
+            "count": len(values),
+            "total": total,
+            "mean": total / len(values) if values else 0.0,
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": values[-1] if values else 0.0,
+        }
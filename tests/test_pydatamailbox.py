@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import io
+import json
 import requests_mock
 import pytest
 import os
@@ -12,7 +14,12 @@ from pydatamailbox import (
     DataMailbox,
     DataMailboxArgsError,
     DataMailboxBaseException,
+    DataMailboxResponseError,
     M2Web,
+    MergeBuffer,
+    Profiler,
+    SnapshotPlan,
+    SnapshotPlanner,
 )
 
 
@@ -228,3 +235,299 @@ def test_m2web():
         mock.post("https://m2web.talk2m.com/t2mapi/getewons", text="no json")
         with pytest.raises(DataMailboxBaseException):
             client.getewons()
+
+
+def test_merge_buffer():
+    client = DataMailbox(account="test", username="test", password="test", devid="test")
+    buffer = MergeBuffer(window=5)
+    with Talk2mMocker():
+        buffer.push(client.getdata(1, 1, "2021-07-15T12:30:20", "2021-07-15T12:30:33"))
+        assert buffer.pop() == [(1, 1, [{"date": "2021-07-15T12:30:22Z", "value": 1}])]
+        buffer.push(client.getdata(1, 1, "2021-07-15T12:30:20", "2021-07-15T12:30:33"))
+        assert buffer.duplicates == 3
+    buffer.add(
+        1,
+        1,
+        [
+            {"date": "2021-07-15T12:30:25Z", "value": 2},
+            {"date": "2021-07-15T12:30:23.600Z", "value": 4},
+            {"date": "2021-07-15T12:30:23.100Z", "value": 3},
+            {"date": "2021-07-15T12:30:23.100Z", "value": 3},
+            {"date": "2021-07-15T12:30:21Z", "value": 5},
+        ],
+    )
+    assert len(buffer) == 5
+    assert buffer.duplicates == 4
+    assert buffer.late == 1
+    assert [point["value"] for point in buffer.pop()[0][2]] == [3, 4]
+    assert [point["value"] for point in buffer.flush()[0][2]] == [2, 0, 1]
+    assert not len(buffer)
+    assert not buffer.flush()
+    with pytest.raises(DataMailboxArgsError):
+        buffer.add(
+            1,
+            1,
+            [
+                {"date": "2021-07-15T12:30:40Z", "value": 6},
+                {"date": "yesterday", "value": 0},
+            ],
+        )
+    with pytest.raises(DataMailboxArgsError):
+        buffer.push(
+            {
+                "ewons": [
+                    {
+                        "id": 1,
+                        "tags": [
+                            {
+                                "id": 2,
+                                "history": [{"date": "2021-07-15T12:30:40Z"}],
+                            },
+                            {"id": 3, "history": [{"date": "yesterday"}]},
+                        ],
+                    }
+                ]
+            }
+        )
+    assert not len(buffer)
+    assert (buffer.duplicates, buffer.late) == (4, 1)
+    with pytest.raises(DataMailboxArgsError):
+        MergeBuffer(window=-1)
+
+
+def test_snapshot_planner():
+    client = DataMailbox(account="test", username="test", password="test", devid="test")
+    with Talk2mMocker() as mock:
+        plan = SnapshotPlanner(client, target_points=1).plan()
+        assert [unit["id"] for unit in plan.units] == ["syncdata:1"]
+        assert plan.requests == 1
+        assert list(plan.execute(client, plan.units[0]))
+
+        mock.post(
+            "https://data.talk2m.com/getstatus",
+            json={
+                "historyCount": 13,
+                "ewonsCount": 4,
+                "ewons": [
+                    {
+                        "id": ewon_id,
+                        "name": "test",
+                        "historyCount": history_count,
+                        "firstHistoryDate": "2018-10-10T00:00:00Z",
+                        "lastHistoryDate": "2018-10-20T00:00:00Z",
+                    }
+                    for ewon_id, history_count in ((1, 8), (2, 3), (3, 2), (4, 0))
+                ],
+            },
+        )
+        planner = SnapshotPlanner(client, target_points=5, request_time=2)
+        plan = planner.plan()
+        assert [unit["id"] for unit in plan.units] == [
+            "getdata:1:1:0",
+            "getdata:1:1:1",
+            "syncdata:2,3",
+        ]
+        assert plan.units[1]["from"] == "2018-10-15T00:00:00Z"
+        assert plan.units[1]["to"] == "2018-10-20T00:00:00Z"
+        assert plan.points == 13
+        assert plan.requests == 3
+        assert plan.estimate_time() == 6
+        assert plan.estimate_time(workers=2) == 4
+        assert [unit["id"] for unit in planner.plan(ewon_ids=[2]).units] == [
+            "syncdata:2"
+        ]
+
+        plan = SnapshotPlan.from_dict(plan.to_dict())
+        assert [unit["id"] for unit in plan.pending(["getdata:1:1:0"])] == [
+            "getdata:1:1:1",
+            "syncdata:2,3",
+        ]
+        assert len(list(plan.execute(client, plan.units[0]))) == 1
+
+        def getdata(date, more_data_available):
+            return {
+                "json": {
+                    "success": True,
+                    "moreDataAvailable": more_data_available,
+                    "ewons": [
+                        {
+                            "id": 1,
+                            "tags": [
+                                {"id": 1, "history": [{"date": date, "value": 1}]}
+                            ],
+                        }
+                    ],
+                }
+            }
+
+        mock.post(
+            "https://data.talk2m.com/getdata",
+            [
+                getdata("2018-10-10T00:00:00.900Z", True),
+                getdata("2018-10-11T00:00:00Z", False),
+            ],
+        )
+        assert len(list(plan.execute(client, plan.units[0]))) == 2
+        assert "from=2018-10-10T00%3A00%3A00.900Z" in mock.last_request.text
+        mock.post(
+            "https://data.talk2m.com/getdata",
+            [getdata("2018-10-10T00:00:00Z", True)],
+        )
+        with pytest.raises(DataMailboxResponseError):
+            list(plan.execute(client, plan.units[0]))
+
+        mock.post(
+            "https://data.talk2m.com/getewon",
+            json={"success": True, "id": 1, "name": "test", "tags": []},
+        )
+        assert [unit["id"] for unit in planner.plan().units] == [
+            "syncdata:1",
+            "syncdata:2,3",
+        ]
+
+        mock.post(
+            "https://data.talk2m.com/getewon",
+            json={"success": True, "id": 1, "name": "test", "tags": [{"id": 1}]},
+        )
+        mock.post(
+            "https://data.talk2m.com/getstatus",
+            json={
+                "historyCount": 103,
+                "ewonsCount": 2,
+                "ewons": [
+                    {
+                        "id": 1,
+                        "name": "test",
+                        "historyCount": 100,
+                        "firstHistoryDate": "2018-10-10T00:00:00.500Z",
+                        "lastHistoryDate": "2018-10-10T00:00:01.500Z",
+                    },
+                    {
+                        "id": 2,
+                        "name": "test",
+                        "historyCount": 3,
+                        "firstHistoryDate": "2018-10-10T00:00:00Z",
+                        "lastHistoryDate": "2018-10-10T00:00:01Z",
+                    },
+                ],
+            },
+        )
+        plan = SnapshotPlanner(client, target_points=10, page_size=2).plan()
+        assert [(unit["from"], unit["to"]) for unit in plan.units[:2]] == [
+            ("2018-10-10T00:00:00Z", "2018-10-10T00:00:01Z"),
+            ("2018-10-10T00:00:01Z", "2018-10-10T00:00:02Z"),
+        ]
+        assert [unit["requests"] for unit in plan.units] == [5, 5, 2]
+
+        mock.post(
+            "https://data.talk2m.com/getewon",
+            json={
+                "success": True,
+                "id": 1,
+                "name": "test",
+                "tags": [{"id": tag_id} for tag_id in range(1000)],
+            },
+        )
+        mock.post(
+            "https://data.talk2m.com/getstatus",
+            json={
+                "historyCount": 40000,
+                "ewonsCount": 2,
+                "ewons": [
+                    {
+                        "id": 1,
+                        "name": "test",
+                        "historyCount": 20000,
+                        "firstHistoryDate": "2018-10-10T00:00:00Z",
+                        "lastHistoryDate": "2018-10-20T00:00:00Z",
+                    },
+                    {"id": 2, "name": "test", "historyCount": 20000},
+                ],
+            },
+        )
+        plan = SnapshotPlanner(client).plan()
+        assert [(unit["id"], unit["requests"]) for unit in plan.units] == [
+            ("syncdata:1", 2),
+            ("syncdata:2", 2),
+        ]
+
+        with pytest.raises(DataMailboxArgsError):
+            plan.estimate_time(workers=0)
+    with pytest.raises(DataMailboxArgsError):
+        SnapshotPlanner(client, target_points=0)
+    with pytest.raises(DataMailboxArgsError):
+        SnapshotPlanner(client, page_size=0)
+
+
+def test_profiler():
+    profiler = Profiler()
+    client = DataMailbox(
+        account="test",
+        username="test",
+        password="test",
+        devid="test",
+        profiler=profiler,
+    )
+    with Talk2mMocker():
+        assert client.getstatus()
+        assert len(list(client.iterate_syncdata())) == 2
+    with requests_mock.mock() as mock:
+        mock.post("https://data.talk2m.com/getewons", status_code=502)
+        with pytest.raises(DataMailboxBaseException):
+            client.getewons()
+
+    report = profiler.report(slowest=2)
+    assert report["calls"] == 4
+    assert report["duration"]["count"] == 4
+    assert tuple(report["stages"]) == Profiler.STAGES
+    assert report["stages"]["build"]["count"] == 4
+    assert report["stages"]["check"]["count"] == 3
+    assert report["stages"]["consumer"]["count"] == 2
+    assert len(report["slowest"]) == 2
+    assert all(
+        sum(call["stages"].values()) <= call["duration"] for call in report["slowest"]
+    )
+    assert [call["error"] for call in profiler.calls] == [
+        None,
+        None,
+        None,
+        "DataMailboxStatusError",
+    ]
+
+    fp = io.StringIO()
+    profiler.dump_trace(fp)
+    events = json.loads(fp.getvalue())["traceEvents"]
+    assert [event["name"] for event in events if event["cat"] == "call"] == [
+        "getstatus",
+        "syncdata",
+        "syncdata",
+        "getewons",
+    ]
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+    calls = [event for event in events if event["cat"] == "call"]
+    assert all(
+        event["ts"] >= calls[1]["ts"] + calls[1]["dur"]
+        for event in events
+        if event["cat"] == "consumer"
+    )
+
+    profiler.reset()
+    assert profiler.report()["calls"] == 0
+    with Talk2mMocker():
+        for data in client.iterate_syncdata():
+            assert client.getewons()
+        for data in client.iterate_syncdata():
+            break
+    assert [call["consumer"] is not None for call in profiler.calls] == [
+        True,
+        False,
+        True,
+        False,
+        True,
+    ]
+
+    profiler = Profiler()
+    profiler.mark("build")
+    profiler.end()
+    assert profiler.last_call() is None
+    assert profiler.report()["duration"]["max"] == 0